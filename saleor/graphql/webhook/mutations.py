@@ -2,6 +2,7 @@ import graphene
 from django.core.exceptions import ValidationError
 
 from ...core.permissions import AppPermission
+from ...plugins.webhook.shipping import clear_webhooks_cache
 from ...webhook import models
 from ...webhook.error_codes import WebhookErrorCode
 from ..core.descriptions import DEPRECATED_IN_3X_INPUT
@@ -115,6 +116,8 @@ class WebhookCreate(ModelMutation):
                 for event in events
             ]
         )
+        # bulk_create doesn't send the post_save signal clearing the cache
+        clear_webhooks_cache()
 
 
 class WebhookUpdateInput(graphene.InputObjectType):
@@ -201,6 +204,8 @@ class WebhookUpdate(ModelMutation):
                     for event in events
                 ]
             )
+            # bulk_create doesn't send the post_save signal clearing the cache
+            clear_webhooks_cache()
 
 
 class WebhookDelete(ModelDeleteMutation):
@@ -58,6 +58,34 @@ def test_webhook_create_by_app(app_api_client, permission_manage_orders):
     assert events[0].event_type == WebhookEventTypeAsyncEnum.ORDER_CREATED.value
 
 
+@patch("saleor.graphql.webhook.mutations.clear_webhooks_cache")
+def test_webhook_create_clears_webhooks_cache(
+    mocked_clear_webhooks_cache, app_api_client, permission_manage_checkouts
+):
+    # given
+    variables = {
+        "input": {
+            "name": "New integration",
+            "targetUrl": "https://www.example.com",
+            "syncEvents": [
+                WebhookEventTypeSyncEnum.CHECKOUT_FILTER_SHIPPING_METHODS.name
+            ],
+        }
+    }
+
+    # when
+    response = app_api_client.post_graphql(
+        WEBHOOK_CREATE,
+        variables=variables,
+        permissions=[permission_manage_checkouts],
+        check_no_permissions=False,
+    )
+
+    # then
+    get_graphql_content(response)
+    mocked_clear_webhooks_cache.assert_called_once_with()
+
+
 def test_webhook_create_inactive_app(app_api_client, app, permission_manage_orders):
     app.is_active = False
     app.save()
@@ -300,6 +328,30 @@ def test_webhook_update_by_staff(
     assert events[0].event_type == WebhookEventTypeAsyncEnum.CUSTOMER_CREATED.value
 
 
+@patch("saleor.graphql.webhook.mutations.clear_webhooks_cache")
+def test_webhook_update_events_clears_webhooks_cache(
+    mocked_clear_webhooks_cache, staff_api_client, webhook, permission_manage_apps
+):
+    # given
+    webhook_id = graphene.Node.to_global_id("Webhook", webhook.pk)
+    variables = {
+        "id": webhook_id,
+        "input": {
+            "syncEvents": [
+                WebhookEventTypeSyncEnum.CHECKOUT_FILTER_SHIPPING_METHODS.name
+            ],
+        },
+    }
+    staff_api_client.user.user_permissions.add(permission_manage_apps)
+
+    # when
+    response = staff_api_client.post_graphql(WEBHOOK_UPDATE, variables=variables)
+
+    # then
+    get_graphql_content(response)
+    mocked_clear_webhooks_cache.assert_called_once_with()
+
+
 def test_webhook_update_by_staff_without_permission(staff_api_client, app, webhook):
     query = WEBHOOK_UPDATE
     webhook_id = graphene.Node.to_global_id("Webhook", webhook.pk)
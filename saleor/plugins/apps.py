@@ -3,6 +3,7 @@ from typing import TYPE_CHECKING, List
 from django.apps import AppConfig
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.utils.module_loading import import_string
 
 if TYPE_CHECKING:
@@ -19,6 +20,28 @@ class PluginConfig(AppConfig):
         for plugin_path in plugins:
             self.load_and_check_plugin(plugin_path)
 
+        self.connect_webhooks_cache_signals()
+
+    def connect_webhooks_cache_signals(self):
+        from ..app.models import App
+        from ..webhook.models import Webhook, WebhookEvent
+        from .webhook.shipping import clear_webhooks_cache
+
+        for model in (App, Webhook, WebhookEvent):
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    clear_webhooks_cache,
+                    sender=model,
+                    dispatch_uid=f"clear_webhooks_cache_{model.__name__}",
+                )
+        # Webhooks are fetched only for apps with the permission required by the
+        # event, so changes of app permissions also invalidate the cache.
+        m2m_changed.connect(
+            clear_webhooks_cache,
+            sender=App.permissions.through,
+            dispatch_uid="clear_webhooks_cache_App_permissions",
+        )
+
     def load_and_check_plugin(self, plugin_path: str):
         try:
             plugin = import_string(plugin_path)
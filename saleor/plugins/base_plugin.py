@@ -73,6 +73,8 @@ class ExternalAccessTokens:
 
 @dataclass
 class ExcludedShippingMethod:
+    __slots__ = ("id", "reason")
+
     id: str
     reason: Optional[str]
 
@@ -1,3 +1,11 @@
 CACHE_EXCLUDED_SHIPPING_KEY = "webhook_exclude_shipping_id_"
+CACHE_EXCLUDED_SHIPPING_HASHED_KEY_PREFIX = "es:"
 CACHE_EXCLUDED_SHIPPING_TIME = 60 * 3
 EXCLUDED_SHIPPING_REQUEST_TIMEOUT = 2
+EXCLUDED_SHIPPING_MAX_WORKERS = 16
+# Time added to the requests' time when waiting for a concurrent fetch, covers
+# saving the deliveries and attempts in the database.
+EXCLUDED_SHIPPING_IN_FLIGHT_WAIT_MARGIN = 3
+LOCAL_CACHE_EXCLUDED_SHIPPING_TIME = 2
+LOCAL_CACHE_EXCLUDED_SHIPPING_SIZE = 256
+CACHE_EXCLUDED_SHIPPING_WEBHOOKS_TIME = 5
@@ -1,17 +1,44 @@
 import base64
+import http.cookiejar
 import logging
-from collections import defaultdict
-from typing import TYPE_CHECKING, Any, Callable, Dict, List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import blake2b
+from operator import attrgetter
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-import graphene
+import requests
 from django.core.cache import cache
-from django.db.models import QuerySet
+from django.db import transaction
 from prices import Money
+from requests.adapters import HTTPAdapter
 
 from ...shipping.interface import ShippingMethodData
+from ...webhook.models import Webhook
 from ..base_plugin import ExcludedShippingMethod
-from .const import CACHE_EXCLUDED_SHIPPING_TIME, EXCLUDED_SHIPPING_REQUEST_TIMEOUT
-from .tasks import _get_webhooks_for_event, trigger_webhook_sync
+from .const import (
+    CACHE_EXCLUDED_SHIPPING_HASHED_KEY_PREFIX,
+    CACHE_EXCLUDED_SHIPPING_TIME,
+    CACHE_EXCLUDED_SHIPPING_WEBHOOKS_TIME,
+    EXCLUDED_SHIPPING_IN_FLIGHT_WAIT_MARGIN,
+    EXCLUDED_SHIPPING_MAX_WORKERS,
+    EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+    LOCAL_CACHE_EXCLUDED_SHIPPING_SIZE,
+    LOCAL_CACHE_EXCLUDED_SHIPPING_TIME,
+)
+from .tasks import (
+    WebhookResponse,
+    WebhookSyncRequest,
+    _get_webhooks_for_event,
+    create_sync_event_delivery,
+    finish_webhook_request_sync,
+    prepare_webhook_request_sync,
+    send_prepared_webhook_request_sync,
+    trigger_webhook_sync,
+)
 from .utils import APP_ID_PREFIX
 
 if TYPE_CHECKING:
@@ -20,64 +47,329 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# Session shared by sync requests to shipping apps, so subsequent requests to the
+# same host reuse already established connections. Cookies are never stored, so
+# responses for one checkout can't leak into requests made for another one.
+http_session = requests.Session()
+http_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+_http_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+http_session.mount("https://", _http_adapter)
+http_session.mount("http://", _http_adapter)
+
+# Payload hash and reasons of methods excluded by webhooks for that payload, mapped
+# by method IDs.
+CachedExcludedShippingData = Tuple[bytes, Dict[str, List[str]]]
+
+# Process-local cache kept in front of the shared cache backend, to avoid a network
+# round-trip for the same checkout or order fetched many times in a short period.
+_local_cache: "OrderedDict[str, Tuple[float, CachedExcludedShippingData]]" = (
+    OrderedDict()
+)
+_local_cache_lock = threading.Lock()
+
+
+def _local_cache_get(key: str) -> Optional[CachedExcludedShippingData]:
+    with _local_cache_lock:
+        entry = _local_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del _local_cache[key]
+            return None
+        _local_cache.move_to_end(key)
+        return value
+
+
+def _local_cache_set(key: str, value: CachedExcludedShippingData):
+    with _local_cache_lock:
+        expires_at = time.monotonic() + LOCAL_CACHE_EXCLUDED_SHIPPING_TIME
+        _local_cache[key] = (expires_at, value)
+        _local_cache.move_to_end(key)
+        if len(_local_cache) > LOCAL_CACHE_EXCLUDED_SHIPPING_SIZE:
+            _local_cache.popitem(last=False)
+
+
+def clear_local_cache():
+    with _local_cache_lock:
+        _local_cache.clear()
+
+
+def get_cached_excluded_shipping_data(
+    cache_key: str, payload_hash: bytes
+) -> Optional[CachedExcludedShippingData]:
+    """Return cached data from the local cache, fall back to the cache backend.
+
+    The local cache is used only when it matches the payload hash, otherwise the
+    data could be already refreshed in the cache backend by other processes.
+    """
+    cached_data = _local_cache_get(cache_key)
+    if cached_data is not None and cached_data[0] == payload_hash:
+        return cached_data
+    cached_data = cache.get(cache_key)
+    if cached_data:
+        _local_cache_set(cache_key, cached_data)
+    return cached_data
+
+
+def set_cached_excluded_shipping_data(cache_key: str, data: CachedExcludedShippingData):
+    cache.set(cache_key, data, CACHE_EXCLUDED_SHIPPING_TIME)
+    _local_cache_set(cache_key, data)
+
+
+# Active webhooks subscribed to the event type, to not query them on each request.
+# The cache is cleared when webhooks or apps are changed.
+_webhooks_cache: Dict[str, Tuple[float, List["Webhook"]]] = {}
+_webhooks_cache_lock = threading.Lock()
+
+
+def get_webhooks_for_event(event_type: str) -> List["Webhook"]:
+    with _webhooks_cache_lock:
+        entry = _webhooks_cache.get(event_type)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    webhooks = list(_get_webhooks_for_event(event_type))
+    expires_at = time.monotonic() + CACHE_EXCLUDED_SHIPPING_WEBHOOKS_TIME
+    with _webhooks_cache_lock:
+        _webhooks_cache[event_type] = (expires_at, webhooks)
+    return webhooks
+
+
+def _clear_webhooks_cache():
+    with _webhooks_cache_lock:
+        _webhooks_cache.clear()
+
+
+def clear_webhooks_cache(**_kwargs):
+    """Clear cached webhooks now and once the current transaction is committed.
+
+    Clearing it after the commit drops webhooks cached in the meantime by
+    concurrent requests, which could still read rows from before the change.
+    """
+    _clear_webhooks_cache()
+    transaction.on_commit(_clear_webhooks_cache)
+
+
+def _filter_apps_with_webhooks(apps: List["App"], event_type: str) -> List["App"]:
+    """Return the apps which still have an active webhook for the event.
+
+    Webhooks are cached by each process for a few seconds, so some of the apps
+    could have been deactivated or lost their webhooks or permissions since.
+    """
+    webhooks = _get_webhooks_for_event(event_type, Webhook.objects.filter(app__in=apps))
+    app_ids = set(webhooks.prefetch_related(None).values_list("app_id", flat=True))
+    return [app for app in apps if app.pk in app_ids]
+
+
+@lru_cache(maxsize=1024)
+def _get_app_id_prefix(app_pk: int) -> bytes:
+    return f"{APP_ID_PREFIX}:{app_pk}:".encode("utf-8")
+
+
+def _encode_shipping_app_id(prefix: bytes, shipping_method_id: str) -> str:
+    return base64.b64encode(prefix + str(shipping_method_id).encode("utf-8")).decode(
+        "ascii"
+    )
+
 
 def to_shipping_app_id(app: "App", shipping_method_id: str) -> "str":
-    return base64.b64encode(
-        str.encode(f"{APP_ID_PREFIX}:{app.pk}:{shipping_method_id}")
-    ).decode("utf-8")
+    return _encode_shipping_app_id(_get_app_id_prefix(app.pk), shipping_method_id)
 
 
 def parse_list_shipping_methods_response(
-    response_data: Any, app: "App"
+    response_data: List[dict], app: "App"
 ) -> List["ShippingMethodData"]:
-    shipping_methods = []
-    for shipping_method_data in response_data:
-        method_id = shipping_method_data.get("id")
-        method_name = shipping_method_data.get("name")
-        method_amount = shipping_method_data.get("amount")
-        method_currency = shipping_method_data.get("currency")
-        method_maximum_delivery_days = shipping_method_data.get("maximum_delivery_days")
-
-        shipping_methods.append(
-            ShippingMethodData(
-                id=to_shipping_app_id(app, method_id),
-                name=method_name,
-                price=Money(method_amount, method_currency),
-                maximum_delivery_days=method_maximum_delivery_days,
+    prefix = _get_app_id_prefix(app.pk)
+    return [
+        ShippingMethodData(
+            id=_encode_shipping_app_id(prefix, method_data.get("id")),
+            name=method_data.get("name"),
+            price=Money(method_data.get("amount"), method_data.get("currency")),
+            maximum_delivery_days=method_data.get("maximum_delivery_days"),
+        )
+        for method_data in response_data
+    ]
+
+
+def _send_excluded_shipping_webhook_request(
+    request: WebhookSyncRequest,
+) -> Tuple[WebhookResponse, Optional[dict]]:
+    return send_prepared_webhook_request_sync(
+        request, timeout=EXCLUDED_SHIPPING_REQUEST_TIMEOUT, session=http_session
+    )
+
+
+def fetch_excluded_shipping_webhook_responses(
+    apps: List["App"], event_type: str, payload: str
+) -> List[Optional[dict]]:
+    """Call webhooks of all apps concurrently and return responses in apps order."""
+    if not apps:
+        return []
+    if len(apps) == 1:
+        return [
+            trigger_webhook_sync(
+                event_type,
+                payload,
+                apps[0],
+                EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+                session=http_session,
             )
+        ]
+
+    # Only the HTTP requests are sent in worker threads. Deliveries and attempts
+    # are saved in the calling thread, using its database connection and
+    # transaction.
+    webhook_requests = [
+        prepare_webhook_request_sync(
+            app.name, create_sync_event_delivery(event_type, payload, app)
+        )
+        for app in apps
+    ]
+    max_workers = min(len(apps), EXCLUDED_SHIPPING_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(_send_excluded_shipping_webhook_request, webhook_requests)
         )
-    return shipping_methods
 
+    responses_data = []
+    for request, (response, response_data) in zip(webhook_requests, results):
+        finish_webhook_request_sync(request, response)
+        responses_data.append(response_data)
+    return responses_data
 
-def get_excluded_shipping_methods_or_fetch(
-    webhooks: QuerySet, event_type: str, payload: str, cache_key: str
-) -> Dict[str, List[ExcludedShippingMethod]]:
-    """Return data of all excluded shipping methods.
 
-    The data will be fetched from the cache. If missing it will fetch it from all
-    defined webhooks by calling a request to each of them one by one.
+def get_payload_hash(payload: str) -> bytes:
+    return blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+def get_hashed_cache_key(cache_key: str) -> str:
+    """Return a short cache key of a fixed length for the given key."""
+    key_hash = blake2b(cache_key.encode("utf-8"), digest_size=16).hexdigest()
+    return CACHE_EXCLUDED_SHIPPING_HASHED_KEY_PREFIX + key_hash
+
+
+class _InFlightFetch:
+    """Fetch of excluded shipping methods in progress, shared by waiting threads."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.reasons_map: Optional[Dict[str, List[str]]] = None
+
+
+# Fetches in progress mapped by the cache key and the payload hash. Concurrent
+# requests with the same payload wait for the first one instead of calling
+# the webhooks again.
+_in_flight: Dict[Tuple[str, bytes], _InFlightFetch] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _get_apps(webhooks: List["Webhook"]) -> List["App"]:
+    # The sync request is sent per app, so an app with many webhooks subscribed to
+    # the event is called only once.
+    return list({webhook.app_id: webhook.app for webhook in webhooks}.values())
+
+
+def _get_in_flight_wait_timeout(apps_count: int) -> int:
+    """Return the longest time the fetch for the given number of apps can take.
+
+    The request timeout applies separately to connecting and reading the response,
+    and apps above the workers limit wait for a free worker.
     """
-    cached_data = cache.get(cache_key)
+    rounds = max(-(-apps_count // EXCLUDED_SHIPPING_MAX_WORKERS), 1)
+    request_timeout = 2 * EXCLUDED_SHIPPING_REQUEST_TIMEOUT
+    return rounds * request_timeout + EXCLUDED_SHIPPING_IN_FLIGHT_WAIT_MARGIN
+
+
+def _get_cached_reasons_map(
+    cache_key: str, payload_hash: bytes
+) -> Optional[Dict[str, List[str]]]:
+    cached_data = get_cached_excluded_shipping_data(cache_key, payload_hash)
     if cached_data:
-        cached_payload, excluded_shipping_methods = cached_data
-        if payload == cached_payload:
-            return parse_excluded_shipping_methods(excluded_shipping_methods)
+        cached_payload_hash, reasons_map = cached_data
+        if payload_hash == cached_payload_hash:
+            return reasons_map
+    return None
+
+
+def _fetch_excluded_shipping_methods(
+    apps: List["App"],
+    event_type: str,
+    payload: str,
+    cache_key: str,
+    payload_hash: bytes,
+) -> Dict[str, List[str]]:
+    apps = _filter_apps_with_webhooks(apps, event_type)
 
     excluded_methods = []
     # Gather responses from webhooks
-    for webhook in webhooks:
-        response_data = trigger_webhook_sync(
-            event_type,
-            payload,
-            webhook.app,
-            EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
-        )
+    responses = fetch_excluded_shipping_webhook_responses(apps, event_type, payload)
+    for response_data in responses:
         if response_data:
             excluded_methods.extend(
                 get_excluded_shipping_methods_from_response(response_data)
             )
-    cache.set(cache_key, (payload, excluded_methods), CACHE_EXCLUDED_SHIPPING_TIME)
-    return parse_excluded_shipping_methods(excluded_methods)
+    reasons_map = parse_excluded_shipping_methods(excluded_methods)
+    set_cached_excluded_shipping_data(cache_key, (payload_hash, reasons_map))
+    return reasons_map
+
+
+def get_excluded_shipping_methods_or_fetch(
+    webhooks: List["Webhook"],
+    event_type: str,
+    payload: str,
+    cache_key: str,
+) -> Dict[str, List[str]]:
+    """Return reasons of all excluded shipping methods mapped by their IDs.
+
+    The data will be fetched from the cache. If missing it will fetch it from all
+    defined webhooks by calling requests to them concurrently, once per app.
+    The cached data is matched by the payload hash.
+    Concurrent calls for the same payload within the process are coalesced, only
+    the first one calls the webhooks.
+    The returned map can be shared with the cache, it must not be modified.
+    """
+    cache_key = get_hashed_cache_key(cache_key)
+    payload_hash = get_payload_hash(payload)
+
+    cached_reasons_map = _get_cached_reasons_map(cache_key, payload_hash)
+    if cached_reasons_map is not None:
+        return cached_reasons_map
+
+    apps = _get_apps(webhooks)
+    flight_key = (cache_key, payload_hash)
+    with _in_flight_lock:
+        flight = _in_flight.get(flight_key)
+        is_leader = flight is None
+        if flight is None:
+            flight = _in_flight[flight_key] = _InFlightFetch()
+
+    if not is_leader:
+        flight.done.wait(timeout=_get_in_flight_wait_timeout(len(apps)))
+        if flight.reasons_map is not None:
+            return flight.reasons_map
+        # The first request failed or didn't finish in time. It could have still
+        # cached the data in the meantime, fetch it on our own otherwise.
+        cached_reasons_map = _get_cached_reasons_map(cache_key, payload_hash)
+        if cached_reasons_map is not None:
+            return cached_reasons_map
+        return _fetch_excluded_shipping_methods(
+            apps, event_type, payload, cache_key, payload_hash
+        )
+
+    try:
+        reasons_map = _fetch_excluded_shipping_methods(
+            apps, event_type, payload, cache_key, payload_hash
+        )
+        flight.reasons_map = reasons_map
+    finally:
+        flight.done.set()
+        with _in_flight_lock:
+            _in_flight.pop(flight_key, None)
+    return reasons_map
+
+
+_get_id_and_reason = attrgetter("id", "reason")
 
 
 def get_excluded_shipping_data(
@@ -98,27 +390,47 @@ def get_excluded_shipping_data(
     webhook.
     """
 
-    excluded_methods_map: Dict[str, List[ExcludedShippingMethod]] = defaultdict(list)
-    webhooks = _get_webhooks_for_event(event_type)
+    webhooks = get_webhooks_for_event(event_type)
+    if not webhooks and not previous_value:
+        return []
+
+    reasons_map: Dict[str, List[str]] = {}
     if webhooks:
         payload = payload_fun()
 
-        excluded_methods_map = get_excluded_shipping_methods_or_fetch(
-            webhooks, event_type, payload, cache_key
+        # Copy the map, as the fetched one is shared with the cache
+        reasons_map = dict(
+            get_excluded_shipping_methods_or_fetch(
+                webhooks, event_type, payload, cache_key
+            )
         )
 
     # Gather responses for previous plugins
-    for method in previous_value:
-        excluded_methods_map[method.id].append(method)
+    for method_id, method_reason in map(_get_id_and_reason, previous_value):
+        reasons = reasons_map.get(method_id, [])
+        if method_reason:
+            reasons = reasons + [method_reason]
+        reasons_map[method_id] = reasons
 
     # Return a list of excluded methods, unique by id
-    excluded_methods = []
-    for method_id, methods in excluded_methods_map.items():
-        reason = None
-        if reasons := [m.reason for m in methods if m.reason]:
-            reason = " ".join(reasons)
-        excluded_methods.append(ExcludedShippingMethod(id=method_id, reason=reason))
-    return excluded_methods
+    return [
+        ExcludedShippingMethod(id=method_id, reason=" ".join(reasons) or None)
+        for method_id, reasons in reasons_map.items()
+    ]
+
+
+# Map the type of received ID to the function returning ID of excluded method.
+# External shipping methods keep the whole ID, for the rest only a database ID
+# is used.
+_EXCLUDED_METHOD_ID_GETTERS: Dict[str, Callable[[str, str], str]] = {
+    "app": lambda raw_id, _id: raw_id,
+    "ShippingMethod": lambda raw_id, _id: _id,
+}
+
+
+def _parse_global_id(global_id: str) -> Tuple[str, str]:
+    typename, _id = base64.b64decode(global_id).decode("utf-8").split(":", 1)
+    return typename, _id
 
 
 def get_excluded_shipping_methods_from_response(
@@ -128,16 +440,14 @@ def get_excluded_shipping_methods_from_response(
     for method_data in response_data.get("excluded_methods", []):
         try:
             raw_id = method_data["id"]
-            typename, _id = graphene.Node.from_global_id(raw_id)
-            if typename == "app":
-                method_id = raw_id
-            elif typename == "ShippingMethod":
-                method_id = _id
-            else:
+            typename, _id = _parse_global_id(raw_id)
+            get_method_id = _EXCLUDED_METHOD_ID_GETTERS.get(typename)
+            if get_method_id is None:
                 logger.warning(
                     "Invalid type received. Expected ShippingMethod, got %s", typename
                 )
                 continue
+            method_id = get_method_id(raw_id, _id)
         except (KeyError, ValueError, TypeError) as e:
             logger.warning("Malformed ShippingMethod id was provided: %s", e)
             continue
@@ -149,13 +459,15 @@ def get_excluded_shipping_methods_from_response(
 
 def parse_excluded_shipping_methods(
     excluded_methods: List[dict],
-) -> Dict[str, List[ExcludedShippingMethod]]:
-    excluded_methods_map = defaultdict(list)
+) -> Dict[str, List[str]]:
+    """Return non-empty reasons of excluded shipping methods mapped by their IDs."""
+    reasons_map: Dict[str, List[str]] = {}
     for excluded_method in excluded_methods:
         method_id = excluded_method["id"]
-        excluded_methods_map[method_id].append(
-            ExcludedShippingMethod(
-                id=method_id, reason=excluded_method.get("reason", "")
-            )
-        )
-    return excluded_methods_map
+        reason = excluded_method.get("reason")
+        reasons = reasons_map.get(method_id)
+        if reasons is None:
+            reasons_map[method_id] = [reason] if reason else []
+        elif reason:
+            reasons.append(reason)
+    return reasons_map
@@ -3,7 +3,7 @@ import logging
 from dataclasses import dataclass
 from enum import Enum
 from json import JSONDecodeError
-from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple, Type
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple, Type
 from urllib.parse import urlparse, urlunparse
 
 import boto3
@@ -16,7 +16,7 @@ from requests.exceptions import RequestException
 
 from ...celeryconf import app
 from ...core import EventDeliveryStatus
-from ...core.models import EventDelivery, EventPayload
+from ...core.models import EventDelivery, EventDeliveryAttempt, EventPayload
 from ...core.tracing import webhooks_opentracing_trace
 from ...payment import PaymentError
 from ...settings import WEBHOOK_SYNC_TIMEOUT, WEBHOOK_TIMEOUT
@@ -93,8 +93,8 @@ def trigger_webhooks_async(data, event_type, webhooks):
         send_webhook_request_async.delay(delivery.id)
 
 
-def trigger_webhook_sync(event_type: str, data: str, app: "App", timeout=None):
-    """Send a synchronous webhook request."""
+def create_sync_event_delivery(event_type: str, data: str, app: "App") -> EventDelivery:
+    """Create a delivery of a synchronous webhook request for the app."""
     webhooks = _get_webhooks_for_event(event_type, app.webhooks.all())
     webhook = webhooks.first()
     event_payload = EventPayload.objects.create(payload=data)
@@ -106,15 +106,35 @@ def trigger_webhook_sync(event_type: str, data: str, app: "App", timeout=None):
     )
     if not webhooks:
         raise PaymentError(f"No payment webhook found for event: {event_type}.")
+    return delivery
+
+
+def trigger_webhook_sync(
+    event_type: str,
+    data: str,
+    app: "App",
+    timeout=None,
+    session: Optional[requests.Session] = None,
+):
+    """Send a synchronous webhook request."""
+    delivery = create_sync_event_delivery(event_type, data, app)
 
-    kwargs = {}
+    kwargs: Dict[str, Any] = {}
     if timeout:
-        kwargs = {"timeout": timeout}
+        kwargs["timeout"] = timeout
+    if session:
+        kwargs["session"] = session
     return send_webhook_request_sync(app.name, delivery, **kwargs)
 
 
 def send_webhook_using_http(
-    target_url, message, domain, signature, event_type, timeout=WEBHOOK_TIMEOUT
+    target_url,
+    message,
+    domain,
+    signature,
+    event_type,
+    timeout=WEBHOOK_TIMEOUT,
+    session: Optional[requests.Session] = None,
 ):
     """Send a webhook request using http / https protocol.
 
@@ -124,6 +144,7 @@ def send_webhook_using_http(
     :param signature: Webhook secret key checksum.
     :param event_type: Webhook event type.
     :param timeout: Request timeout.
+    :param session: Session used to send the request, allows reusing connections.
 
     :return: WebhookResponse object.
     """
@@ -138,7 +159,8 @@ def send_webhook_using_http(
         "Saleor-Signature": signature,
     }
 
-    response = requests.post(target_url, data=message, headers=headers, timeout=timeout)
+    post = session.post if session else requests.post
+    response = post(target_url, data=message, headers=headers, timeout=timeout)
     return WebhookResponse(
         content=response.text,
         request_headers=headers,
@@ -304,7 +326,19 @@ def send_webhook_request_async(self, event_delivery_id):
     clear_successful_delivery(delivery)
 
 
-def send_webhook_request_sync(app_name, delivery, timeout=WEBHOOK_SYNC_TIMEOUT):
+@dataclass
+class WebhookSyncRequest:
+    app_name: str
+    delivery: EventDelivery
+    attempt: EventDeliveryAttempt
+    target_url: str
+    domain: str
+    message: bytes
+    signature: str
+
+
+def prepare_webhook_request_sync(app_name, delivery) -> WebhookSyncRequest:
+    """Create the delivery attempt and return data of the request to send."""
     event_payload = delivery.payload
     data = event_payload.payload
     webhook = delivery.webhook
@@ -313,64 +347,103 @@ def send_webhook_request_sync(app_name, delivery, timeout=WEBHOOK_SYNC_TIMEOUT):
     message = data.encode("utf-8")
     signature = signature_for_payload(message, webhook.secret_key)
 
+    if parts.scheme.lower() not in [WebhookSchemes.HTTP, WebhookSchemes.HTTPS]:
+        delivery_update(delivery, EventDeliveryStatus.FAILED)
+        raise ValueError("Unknown webhook scheme: %r" % (parts.scheme,))
+
+    logger.debug(
+        "[Webhook] Sending payload to %r for event %r.",
+        webhook.target_url,
+        delivery.event_type,
+    )
+    attempt = create_attempt(delivery=delivery, task_id=None)
+    return WebhookSyncRequest(
+        app_name=app_name,
+        delivery=delivery,
+        attempt=attempt,
+        target_url=webhook.target_url,
+        domain=domain,
+        message=message,
+        signature=signature,
+    )
+
+
+def send_prepared_webhook_request_sync(
+    request: WebhookSyncRequest,
+    timeout=WEBHOOK_SYNC_TIMEOUT,
+    session: Optional[requests.Session] = None,
+) -> Tuple[WebhookResponse, Optional[dict]]:
+    """Send the prepared request and return the response with its parsed content.
+
+    It doesn't use the database, so it can be called outside of the thread that
+    prepared the request.
+    """
+    event_type = request.delivery.event_type
     response = WebhookResponse(content="")
     response_data = None
-    if parts.scheme.lower() in [WebhookSchemes.HTTP, WebhookSchemes.HTTPS]:
+    try:
+        with webhooks_opentracing_trace(
+            event_type, request.domain, sync=True, app_name=request.app_name
+        ):
+            response = send_webhook_using_http(
+                request.target_url,
+                request.message,
+                request.domain,
+                request.signature,
+                event_type,
+                timeout=timeout,
+                session=session,
+            )
+            response_data = json.loads(response.content)
+    except RequestException as e:
+        logger.warning(
+            "[Webhook] Failed request to %r: %r. "
+            "ID of failed DeliveryAttempt: %r . ",
+            request.target_url,
+            e,
+            request.attempt.id,
+        )
+        response.status = EventDeliveryStatus.FAILED
+        if e.response:
+            response.content = e.response.text
+            response.response_headers = dict(e.response.headers)
+
+    except JSONDecodeError as e:
+        logger.warning(
+            "[Webhook] Failed parsing JSON response from %r: %r."
+            "ID of failed DeliveryAttempt: %r . ",
+            request.target_url,
+            e,
+            request.attempt.id,
+        )
+        response.status = EventDeliveryStatus.FAILED
+    else:
         logger.debug(
-            "[Webhook] Sending payload to %r for event %r.",
-            webhook.target_url,
-            delivery.event_type,
+            "[Webhook] Success response from %r." "Succesfull DeliveryAttempt id: %r",
+            request.target_url,
+            request.attempt.id,
         )
-        attempt = create_attempt(delivery=delivery, task_id=None)
-        try:
-            with webhooks_opentracing_trace(
-                delivery.event_type, domain, sync=True, app_name=app_name
-            ):
-                response = send_webhook_using_http(
-                    webhook.target_url,
-                    message,
-                    domain,
-                    signature,
-                    delivery.event_type,
-                    timeout=timeout,
-                )
-                response_data = json.loads(response.content)
-        except RequestException as e:
-            logger.warning(
-                "[Webhook] Failed request to %r: %r. "
-                "ID of failed DeliveryAttempt: %r . ",
-                webhook.target_url,
-                e,
-                attempt.id,
-            )
-            response.status = EventDeliveryStatus.FAILED
-            if e.response:
-                response.content = e.response.text
-                response.response_headers = dict(e.response.headers)
-
-        except JSONDecodeError as e:
-            logger.warning(
-                "[Webhook] Failed parsing JSON response from %r: %r."
-                "ID of failed DeliveryAttempt: %r . ",
-                webhook.target_url,
-                e,
-                attempt.id,
-            )
-            response.status = EventDeliveryStatus.FAILED
-        else:
-            logger.debug(
-                "[Webhook] Success response from %r."
-                "Succesfull DeliveryAttempt id: %r",
-                webhook.target_url,
-                attempt.id,
-            )
+    return response, response_data
 
-        attempt_update(attempt, response)
-    else:
-        delivery_update(delivery, EventDeliveryStatus.FAILED)
-        raise ValueError("Unknown webhook scheme: %r" % (parts.scheme,))
-    delivery_update(delivery, response.status)
-    clear_successful_delivery(delivery)
+
+def finish_webhook_request_sync(request: WebhookSyncRequest, response: WebhookResponse):
+    """Save the result of the request in its delivery attempt and delivery."""
+    attempt_update(request.attempt, response)
+    delivery_update(request.delivery, response.status)
+    clear_successful_delivery(request.delivery)
+
+
+def send_webhook_request_sync(
+    app_name,
+    delivery,
+    timeout=WEBHOOK_SYNC_TIMEOUT,
+    session: Optional[requests.Session] = None,
+):
+    request = prepare_webhook_request_sync(app_name, delivery)
+    response, response_data = send_prepared_webhook_request_sync(
+        request, timeout=timeout, session=session
+    )
+    finish_webhook_request_sync(request, response)
     return response_data
 
 
@@ -134,6 +134,31 @@ def test_send_webhook_request_sync_successful_attempt(
     assert attempt.response_headers == json.dumps(expected_data["headers"])
 
 
+@mock.patch("saleor.plugins.webhook.tasks.requests.post")
+@mock.patch("saleor.plugins.webhook.tasks.clear_successful_delivery")
+def test_send_webhook_request_sync_with_session(
+    mock_clear_delivery, mock_post, app, event_delivery
+):
+    # given
+    session = mock.Mock()
+    session.post.return_value = mock.Mock(
+        ok=True,
+        text='{"key": "response_text"}',
+        headers={"header_key": "header_val"},
+        elapsed=datetime.timedelta(seconds=2),
+    )
+
+    # when
+    send_webhook_request_sync(app.name, event_delivery, session=session)
+
+    # then
+    session.post.assert_called_once()
+    assert session.post.call_args.args[0] == event_delivery.webhook.target_url
+    mock_post.assert_not_called()
+    mock_clear_delivery.assert_called_once_with(event_delivery)
+    assert event_delivery.status == EventDeliveryStatus.SUCCESS
+
+
 @mock.patch("saleor.plugins.webhook.tasks.requests.post", side_effect=RequestException)
 def test_send_webhook_request_sync_request_exception(mock_post, app, event_delivery):
     # when
@@ -1,12 +1,17 @@
+import datetime
 import json
+import time
 from unittest import mock
 
 import graphene
 import pytest
 
-from ....core.models import EventDelivery
+from ....app.models import App
+from ....core import EventDeliveryStatus
+from ....core.models import EventDelivery, EventDeliveryAttempt
 from ....graphql.tests.utils import get_graphql_content
 from ....webhook.event_types import WebhookEventSyncType
+from ....webhook.models import Webhook, WebhookEvent
 from ....webhook.payloads import (
     generate_excluded_shipping_methods_for_checkout_payload,
     generate_excluded_shipping_methods_for_order_payload,
@@ -17,8 +22,16 @@ from ..const import (
     CACHE_EXCLUDED_SHIPPING_TIME,
     EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
 )
-from ..shipping import get_excluded_shipping_methods_from_response, to_shipping_app_id
-from ..tasks import trigger_webhook_sync
+from ..shipping import (
+    fetch_excluded_shipping_webhook_responses,
+    get_excluded_shipping_methods_from_response,
+    get_hashed_cache_key,
+    get_payload_hash,
+    get_webhooks_for_event,
+    http_session,
+    to_shipping_app_id,
+)
+from ..tasks import WebhookResponse, trigger_webhook_sync
 
 ORDER_QUERY_SHIPPING_METHOD = """
     query OrdersQuery {
@@ -92,7 +105,7 @@ def test_excluded_shipping_methods_for_order(
             }
         ]
     }
-    payload = mock.MagicMock()
+    payload = json.dumps({"key": "value"})
     mocked_payload.return_value = payload
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -118,20 +131,23 @@ def test_excluded_shipping_methods_for_order(
         payload,
         shipping_app,
         EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+        session=http_session,
+    )
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
     )
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
 
 @mock.patch("saleor.plugins.webhook.shipping.cache.set")
-@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+@mock.patch("saleor.plugins.webhook.shipping.send_prepared_webhook_request_sync")
 @mock.patch(
     "saleor.plugins.webhook.plugin.generate_excluded_shipping_methods_for_order_payload"
 )
@@ -150,7 +166,7 @@ def test_multiple_app_with_excluded_shipping_methods_for_order(
     webhook_reason = "Order contains dangerous products."
     webhook_second_reason = "Shipping is not applicable for this order."
 
-    mocked_webhook.side_effect = [
+    responses = [
         {
             "excluded_methods": [
                 {
@@ -172,8 +188,15 @@ def test_multiple_app_with_excluded_shipping_methods_for_order(
             ]
         },
     ]
+    app_responses = dict(zip([shipping_app.pk, second_shipping_app.pk], responses))
+
+    def send_request(request, **kwargs):
+        response_data = app_responses[request.delivery.webhook.app_id]
+        return WebhookResponse(content=json.dumps(response_data)), response_data
+
+    mocked_webhook.side_effect = send_request
 
-    payload = mock.MagicMock()
+    payload = json.dumps({"key": "value"})
     mocked_payload.return_value = payload
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -192,33 +215,85 @@ def test_multiple_app_with_excluded_shipping_methods_for_order(
     assert em.id == "1"
     assert webhook_reason in em.reason
     assert webhook_second_reason in em.reason
-    mocked_webhook.assert_any_call(
-        WebhookEventSyncType.ORDER_FILTER_SHIPPING_METHODS,
-        payload,
+    assert mocked_webhook.call_count == 2
+    deliveries = [call.args[0].delivery for call in mocked_webhook.call_args_list]
+    assert {delivery.webhook.app for delivery in deliveries} == {
         shipping_app,
-        EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
-    )
-    mocked_webhook.assert_any_call(
-        WebhookEventSyncType.ORDER_FILTER_SHIPPING_METHODS,
-        payload,
         second_shipping_app,
-        EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+    }
+    for delivery in deliveries:
+        assert delivery.event_type == WebhookEventSyncType.ORDER_FILTER_SHIPPING_METHODS
+        assert delivery.payload.payload == payload
+    for call in mocked_webhook.call_args_list:
+        assert call.kwargs == {
+            "timeout": EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+            "session": http_session,
+        }
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
     )
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
 
-    expected_excluded_shipping_method = [
-        {"id": "1", "reason": webhook_reason},
-        {"id": "1", "reason": webhook_second_reason},
-        {"id": "2", "reason": webhook_second_reason},
-    ]
+    expected_excluded_shipping_method = {
+        "1": [webhook_reason, webhook_second_reason],
+        "2": [webhook_second_reason],
+    }
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
 
+def test_fetch_excluded_shipping_webhook_responses_for_multiple_apps(
+    shipping_app_factory,
+):
+    # given
+    shipping_app = shipping_app_factory()
+    second_shipping_app = shipping_app_factory(app_name="shipping-app2")
+    second_target_url = "https://second-shipping-gateway.com/api/"
+    second_shipping_app.webhooks.update(target_url=second_target_url)
+    payload = json.dumps({"key": "value"})
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+
+    def post(target_url, **kwargs):
+        if target_url == second_target_url:
+            return mock.Mock(
+                ok=False,
+                text="error",
+                headers={},
+                elapsed=datetime.timedelta(seconds=1),
+            )
+        # the first app responds later, so the responses complete in reverse order
+        time.sleep(0.1)
+        return mock.Mock(
+            ok=True,
+            text=json.dumps({"app": shipping_app.name}),
+            headers={},
+            elapsed=datetime.timedelta(seconds=1),
+        )
+
+    # when
+    with mock.patch.object(http_session, "post", side_effect=post) as mocked_post:
+        responses = fetch_excluded_shipping_webhook_responses(
+            [shipping_app, second_shipping_app], event_type, payload
+        )
+
+    # then
+    assert responses == [{"app": shipping_app.name}, None]
+    assert mocked_post.call_count == 2
+
+    # the successful delivery is removed, the failed one is kept with its attempt
+    delivery = EventDelivery.objects.get(event_type=event_type)
+    assert delivery.webhook.app == second_shipping_app
+    assert delivery.status == EventDeliveryStatus.FAILED
+    assert delivery.payload.payload == payload
+    attempt = EventDeliveryAttempt.objects.get(delivery=delivery)
+    assert attempt.status == EventDeliveryStatus.FAILED
+    assert attempt.response == "error"
+    assert attempt.duration == 1
+
+
 def test_parse_excluded_shipping_methods_response(app):
     # given
     external_id = to_shipping_app_id(app, "test-1234")
@@ -410,6 +485,21 @@ def test_trigger_webhook_sync(mock_request, shipping_app):
     mock_request.assert_called_once_with(shipping_app.name, event_delivery)
 
 
+@mock.patch("saleor.plugins.webhook.tasks.send_webhook_request_sync")
+def test_trigger_webhook_sync_with_session(mock_request, shipping_app):
+    data = '{"key": "value"}'
+    trigger_webhook_sync(
+        WebhookEventSyncType.SHIPPING_LIST_METHODS_FOR_CHECKOUT,
+        data,
+        shipping_app,
+        session=http_session,
+    )
+    event_delivery = EventDelivery.objects.first()
+    mock_request.assert_called_once_with(
+        shipping_app.name, event_delivery, session=http_session
+    )
+
+
 @mock.patch("saleor.plugins.webhook.shipping.cache.set")
 @mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
 @mock.patch(
@@ -438,7 +528,7 @@ def test_excluded_shipping_methods_for_checkout(
             }
         ]
     }
-    payload = mock.MagicMock()
+    payload = json.dumps({"key": "value"})
     mocked_payload.return_value = payload
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -463,21 +553,24 @@ def test_excluded_shipping_methods_for_checkout(
         payload,
         shipping_app,
         EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+        session=http_session,
     )
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    )
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
 
 @mock.patch("saleor.plugins.webhook.shipping.cache.set")
-@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+@mock.patch("saleor.plugins.webhook.shipping.send_prepared_webhook_request_sync")
 @mock.patch(
     "saleor.plugins.webhook.plugin."
     "generate_excluded_shipping_methods_for_checkout_payload"
@@ -497,7 +590,7 @@ def test_multiple_app_with_excluded_shipping_methods_for_checkout(
     webhook_reason = "Checkout contains dangerous products."
     webhook_second_reason = "Shipping is not applicable for this checkout."
 
-    mocked_webhook.side_effect = [
+    responses = [
         {
             "excluded_methods": [
                 {
@@ -519,7 +612,14 @@ def test_multiple_app_with_excluded_shipping_methods_for_checkout(
             ]
         },
     ]
-    payload = mock.MagicMock()
+    app_responses = dict(zip([shipping_app.pk, second_shipping_app.pk], responses))
+
+    def send_request(request, **kwargs):
+        response_data = app_responses[request.delivery.webhook.app_id]
+        return WebhookResponse(content=json.dumps(response_data)), response_data
+
+    mocked_webhook.side_effect = send_request
+    payload = json.dumps({"key": "value"})
     mocked_payload.return_value = payload
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -538,33 +638,182 @@ def test_multiple_app_with_excluded_shipping_methods_for_checkout(
     assert em.id == "1"
     assert webhook_reason in em.reason
     assert webhook_second_reason in em.reason
-    mocked_webhook.assert_any_call(
-        WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS,
-        payload,
+    assert mocked_webhook.call_count == 2
+    deliveries = [call.args[0].delivery for call in mocked_webhook.call_args_list]
+    assert {delivery.webhook.app for delivery in deliveries} == {
         shipping_app,
-        EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+        second_shipping_app,
+    }
+    for delivery in deliveries:
+        assert delivery.event_type == (
+            WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+        )
+        assert delivery.payload.payload == payload
+    for call in mocked_webhook.call_args_list:
+        assert call.kwargs == {
+            "timeout": EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+            "session": http_session,
+        }
+
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    )
+
+    expected_excluded_shipping_method = {
+        "1": [webhook_reason, webhook_second_reason],
+        "2": [webhook_second_reason],
+    }
+
+    mocked_cache_set.assert_called_once_with(
+        expected_cache_key,
+        (get_payload_hash(payload), expected_excluded_shipping_method),
+        CACHE_EXCLUDED_SHIPPING_TIME,
+    )
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.set")
+@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+@mock.patch(
+    "saleor.plugins.webhook.plugin."
+    "generate_excluded_shipping_methods_for_checkout_payload"
+)
+def test_app_with_multiple_webhooks_called_once_for_excluded_shipping_methods(
+    mocked_payload,
+    mocked_webhook,
+    mocked_cache_set,
+    webhook_plugin,
+    checkout_with_items,
+    available_shipping_methods_factory,
+    shipping_app_factory,
+):
+    # given
+    shipping_app = shipping_app_factory()
+    webhook = Webhook.objects.create(
+        name="shipping-webhook-2",
+        app=shipping_app,
+        target_url="https://shipping-gateway.com/api/second/",
+    )
+    WebhookEvent.objects.create(
+        event_type=WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS,
+        webhook=webhook,
     )
-    mocked_webhook.assert_any_call(
+    webhook_reason = "Checkout contains dangerous products."
+
+    mocked_webhook.return_value = {
+        "excluded_methods": [
+            {
+                "id": graphene.Node.to_global_id("ShippingMethod", "1"),
+                "reason": webhook_reason,
+            }
+        ]
+    }
+    payload = json.dumps({"key": "value"})
+    mocked_payload.return_value = payload
+    plugin = webhook_plugin()
+    available_shipping_methods = available_shipping_methods_factory(num_methods=2)
+
+    # when
+    excluded_methods = plugin.excluded_shipping_methods_for_checkout(
+        checkout=checkout_with_items,
+        available_shipping_methods=available_shipping_methods,
+        previous_value=[],
+    )
+
+    # then
+    assert excluded_methods == [ExcludedShippingMethod(id="1", reason=webhook_reason)]
+    mocked_webhook.assert_called_once_with(
         WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS,
         payload,
-        second_shipping_app,
+        shipping_app,
         EXCLUDED_SHIPPING_REQUEST_TIMEOUT,
+        session=http_session,
     )
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
 
-    expected_excluded_shipping_method = [
-        {"id": "1", "reason": webhook_reason},
-        {"id": "1", "reason": webhook_second_reason},
-        {"id": "2", "reason": webhook_second_reason},
-    ]
+@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+@mock.patch(
+    "saleor.plugins.webhook.plugin."
+    "generate_excluded_shipping_methods_for_checkout_payload"
+)
+def test_excluded_shipping_methods_skip_app_deactivated_after_webhooks_cached(
+    mocked_payload,
+    mocked_webhook,
+    webhook_plugin,
+    checkout_with_items,
+    available_shipping_methods_factory,
+    shipping_app_factory,
+):
+    # given
+    shipping_app = shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    assert len(get_webhooks_for_event(event_type)) == 1
 
-    mocked_cache_set.assert_called_once_with(
-        expected_cache_key,
-        (payload, expected_excluded_shipping_method),
-        CACHE_EXCLUDED_SHIPPING_TIME,
+    # the app is deactivated by other process, the cached webhooks aren't cleared
+    App.objects.filter(pk=shipping_app.pk).update(is_active=False)
+
+    mocked_payload.return_value = json.dumps({"key": "value"})
+    plugin = webhook_plugin()
+    available_shipping_methods = available_shipping_methods_factory(num_methods=2)
+
+    # when
+    excluded_methods = plugin.excluded_shipping_methods_for_checkout(
+        checkout=checkout_with_items,
+        available_shipping_methods=available_shipping_methods,
+        previous_value=[],
     )
 
+    # then
+    assert excluded_methods == []
+    assert not mocked_webhook.called
+    assert not EventDelivery.objects.exists()
+
+
+def test_get_webhooks_for_event_uses_cache(
+    shipping_app_factory, django_assert_num_queries
+):
+    # given
+    shipping_app = shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    webhooks = get_webhooks_for_event(event_type)
+
+    # when
+    with django_assert_num_queries(0):
+        cached_webhooks = get_webhooks_for_event(event_type)
+
+    # then
+    assert cached_webhooks == webhooks
+    assert [webhook.app for webhook in webhooks] == [shipping_app]
+
+
+def test_get_webhooks_for_event_cache_cleared_on_webhook_change(
+    shipping_app_factory,
+):
+    # given
+    shipping_app = shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    assert len(get_webhooks_for_event(event_type)) == 1
+
+    # when
+    shipping_app.webhooks.first().delete()
+
+    # then
+    assert get_webhooks_for_event(event_type) == []
+
+
+def test_get_webhooks_for_event_cache_cleared_on_app_permissions_change(
+    shipping_app_factory,
+):
+    # given
+    shipping_app = shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    assert len(get_webhooks_for_event(event_type)) == 1
+
+    # when
+    shipping_app.permissions.clear()
+
+    # then
+    assert get_webhooks_for_event(event_type) == []
+
 
 def test_generate_excluded_shipping_methods_for_order_payload(
     webhook_plugin,
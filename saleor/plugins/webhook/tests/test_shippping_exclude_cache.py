@@ -3,8 +3,18 @@ from unittest import mock
 
 import graphene
 
+from ....webhook.event_types import WebhookEventSyncType
 from ...base_plugin import ExcludedShippingMethod
 from ..const import CACHE_EXCLUDED_SHIPPING_KEY, CACHE_EXCLUDED_SHIPPING_TIME
+from ..shipping import (
+    _InFlightFetch,
+    get_cached_excluded_shipping_data,
+    get_excluded_shipping_data,
+    get_excluded_shipping_methods_or_fetch,
+    get_hashed_cache_key,
+    get_payload_hash,
+    get_webhooks_for_event,
+)
 
 
 @mock.patch("saleor.plugins.webhook.shipping.cache.get")
@@ -39,7 +49,10 @@ def test_excluded_shipping_methods_for_order_use_cache(
     payload = json.dumps({"order": {"id": 1, "some_field": "12"}})
     mocked_payload.return_value = payload
 
-    mocked_cache_get.return_value = (payload, [{"id": "1", "reason": webhook_reason}])
+    mocked_cache_get.return_value = (
+        get_payload_hash(payload),
+        {"1": [webhook_reason]},
+    )
 
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -110,13 +123,15 @@ def test_excluded_shipping_methods_for_order_stores_in_cache_when_empty(
     # then
     assert mocked_webhook.called
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
+    )
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
@@ -154,8 +169,8 @@ def test_excluded_shipping_methods_for_order_stores_in_cache_when_payload_is_dif
     mocked_payload.return_value = payload
 
     mocked_cache_get.return_value = (
-        {"order": "different-payload"},
-        [{"id": "1", "reason": webhook_reason}],
+        get_payload_hash(json.dumps({"order": "different-payload"})),
+        {"1": [webhook_reason]},
     )
 
     plugin = webhook_plugin()
@@ -174,13 +189,15 @@ def test_excluded_shipping_methods_for_order_stores_in_cache_when_payload_is_dif
     # then
     assert mocked_webhook.called
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + order_with_lines.token
+    )
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
@@ -219,7 +236,10 @@ def test_excluded_shipping_methods_for_checkout_use_cache(
     payload = json.dumps({"checkout": {"id": 1, "some_field": "12"}})
     mocked_payload.return_value = payload
 
-    mocked_cache_get.return_value = (payload, [{"id": "1", "reason": webhook_reason}])
+    mocked_cache_get.return_value = (
+        get_payload_hash(payload),
+        {"1": [webhook_reason]},
+    )
 
     plugin = webhook_plugin()
     available_shipping_methods = available_shipping_methods_factory(num_methods=2)
@@ -290,13 +310,15 @@ def test_excluded_shipping_methods_for_checkout_stores_in_cache_when_empty(
     # then
     assert mocked_webhook.called
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    )
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
 
@@ -336,8 +358,8 @@ def test_excluded_shipping_methods_for_checkout_stores_in_cache_when_payload_dif
     mocked_payload.return_value = payload
 
     mocked_cache_get.return_value = (
-        {"checkout": "different_payload"},
-        [{"id": "1", "reason": webhook_reason}],
+        get_payload_hash(json.dumps({"checkout": "different_payload"})),
+        {"1": [webhook_reason]},
     )
 
     plugin = webhook_plugin()
@@ -355,12 +377,251 @@ def test_excluded_shipping_methods_for_checkout_stores_in_cache_when_payload_dif
     # then
     assert mocked_webhook.called
 
-    expected_cache_key = CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    expected_cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    )
 
-    expected_excluded_shipping_method = [{"id": "1", "reason": webhook_reason}]
+    expected_excluded_shipping_method = {"1": [webhook_reason]}
 
     mocked_cache_set.assert_called_once_with(
         expected_cache_key,
-        (payload, expected_excluded_shipping_method),
+        (get_payload_hash(payload), expected_excluded_shipping_method),
         CACHE_EXCLUDED_SHIPPING_TIME,
     )
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+@mock.patch("saleor.plugins.webhook.shipping.cache.set")
+@mock.patch("saleor.plugins.webhook.tasks.send_webhook_request_sync")
+@mock.patch(
+    "saleor.plugins.webhook.plugin."
+    "generate_excluded_shipping_methods_for_checkout_payload"
+)
+def test_excluded_shipping_methods_for_checkout_use_local_cache(
+    mocked_payload,
+    mocked_webhook,
+    mocked_cache_set,
+    mocked_cache_get,
+    webhook_plugin,
+    checkout_with_items,
+    available_shipping_methods_factory,
+    shipping_app_factory,
+):
+    # given
+    shipping_app_factory()
+    webhook_reason = "Order contains dangerous products."
+
+    payload = json.dumps({"checkout": {"id": 1, "some_field": "12"}})
+    mocked_payload.return_value = payload
+
+    mocked_cache_get.return_value = (
+        get_payload_hash(payload),
+        {"1": [webhook_reason]},
+    )
+
+    plugin = webhook_plugin()
+    available_shipping_methods = available_shipping_methods_factory(num_methods=2)
+
+    # when
+    for _ in range(2):
+        excluded_methods = plugin.excluded_shipping_methods_for_checkout(
+            checkout=checkout_with_items,
+            available_shipping_methods=available_shipping_methods,
+            previous_value=[],
+        )
+
+    # then
+    assert excluded_methods == [ExcludedShippingMethod(id="1", reason=webhook_reason)]
+    mocked_cache_get.assert_called_once()
+    assert not mocked_webhook.called
+    assert not mocked_cache_set.called
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+@mock.patch("saleor.plugins.webhook.shipping.cache.set")
+@mock.patch("saleor.plugins.webhook.tasks.send_webhook_request_sync")
+@mock.patch(
+    "saleor.plugins.webhook.plugin."
+    "generate_excluded_shipping_methods_for_checkout_payload"
+)
+def test_excluded_shipping_methods_for_checkout_stale_local_cache_uses_cache(
+    mocked_payload,
+    mocked_webhook,
+    mocked_cache_set,
+    mocked_cache_get,
+    webhook_plugin,
+    checkout_with_items,
+    available_shipping_methods_factory,
+    shipping_app_factory,
+):
+    # given
+    shipping_app_factory()
+    webhook_reason = "Order contains dangerous products."
+
+    payload = json.dumps({"checkout": {"id": 1, "some_field": "12"}})
+    mocked_payload.return_value = payload
+    payload_hash = get_payload_hash(payload)
+    cache_key = get_hashed_cache_key(
+        CACHE_EXCLUDED_SHIPPING_KEY + str(checkout_with_items.token)
+    )
+
+    # the local cache holds data for a previous payload
+    mocked_cache_get.return_value = (
+        get_payload_hash(json.dumps({"checkout": "previous-payload"})),
+        {"2": [webhook_reason]},
+    )
+    get_cached_excluded_shipping_data(cache_key, payload_hash)
+
+    # other process has already stored data for the current payload
+    mocked_cache_get.return_value = (payload_hash, {"1": [webhook_reason]})
+
+    plugin = webhook_plugin()
+    available_shipping_methods = available_shipping_methods_factory(num_methods=2)
+
+    # when
+    excluded_methods = plugin.excluded_shipping_methods_for_checkout(
+        checkout=checkout_with_items,
+        available_shipping_methods=available_shipping_methods,
+        previous_value=[],
+    )
+
+    # then
+    assert excluded_methods == [ExcludedShippingMethod(id="1", reason=webhook_reason)]
+    assert mocked_cache_get.call_count == 2
+    assert not mocked_webhook.called
+    assert not mocked_cache_set.called
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+def test_get_excluded_shipping_data_without_webhooks_and_previous_value(
+    mocked_cache_get, db
+):
+    # given
+    payload_fun = mock.Mock()
+
+    # when
+    excluded_methods = get_excluded_shipping_data(
+        event_type=WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS,
+        previous_value=[],
+        payload_fun=payload_fun,
+        cache_key=CACHE_EXCLUDED_SHIPPING_KEY + "token",
+    )
+
+    # then
+    assert excluded_methods == []
+    assert not payload_fun.called
+    assert not mocked_cache_get.called
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+def test_get_excluded_shipping_methods_or_fetch_reuses_concurrent_fetch(
+    mocked_webhook, mocked_cache_get, shipping_app_factory
+):
+    # given
+    shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    webhooks = get_webhooks_for_event(event_type)
+    mocked_cache_get.return_value = None
+
+    payload = json.dumps({"checkout": {"id": 1}})
+    cache_key = CACHE_EXCLUDED_SHIPPING_KEY + "token"
+
+    # other thread has already fetched the data for the same payload
+    flight = _InFlightFetch()
+    flight.reasons_map = {"1": ["Order contains dangerous products."]}
+    flight.done.set()
+    flight_key = (get_hashed_cache_key(cache_key), get_payload_hash(payload))
+
+    # when
+    with mock.patch.dict(
+        "saleor.plugins.webhook.shipping._in_flight", {flight_key: flight}
+    ):
+        reasons_map = get_excluded_shipping_methods_or_fetch(
+            webhooks, event_type, payload, cache_key
+        )
+
+    # then
+    assert reasons_map is flight.reasons_map
+    assert not mocked_webhook.called
+
+
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+@mock.patch("saleor.plugins.webhook.shipping.cache.set")
+@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+def test_get_excluded_shipping_methods_or_fetch_concurrent_fetch_failed(
+    mocked_webhook, mocked_cache_set, mocked_cache_get, shipping_app_factory
+):
+    # given
+    shipping_app = shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    webhooks = get_webhooks_for_event(event_type)
+    webhook_reason = "Order contains dangerous products."
+    mocked_cache_get.return_value = None
+    mocked_webhook.return_value = {
+        "excluded_methods": [
+            {
+                "id": graphene.Node.to_global_id("ShippingMethod", "1"),
+                "reason": webhook_reason,
+            }
+        ]
+    }
+
+    payload = json.dumps({"checkout": {"id": 1}})
+    cache_key = CACHE_EXCLUDED_SHIPPING_KEY + "token"
+
+    # other thread has finished fetching the data without a result
+    flight = _InFlightFetch()
+    flight.done.set()
+    flight_key = (get_hashed_cache_key(cache_key), get_payload_hash(payload))
+
+    # when
+    with mock.patch.dict(
+        "saleor.plugins.webhook.shipping._in_flight", {flight_key: flight}
+    ):
+        reasons_map = get_excluded_shipping_methods_or_fetch(
+            webhooks, event_type, payload, cache_key
+        )
+
+    # then
+    assert reasons_map == {"1": [webhook_reason]}
+    mocked_webhook.assert_called_once()
+    assert mocked_webhook.call_args.args[2] == shipping_app
+    assert mocked_cache_get.call_count == 2
+    mocked_cache_set.assert_called_once()
+
+
+@mock.patch(
+    "saleor.plugins.webhook.shipping._get_in_flight_wait_timeout", return_value=0
+)
+@mock.patch("saleor.plugins.webhook.shipping.cache.get")
+@mock.patch("saleor.plugins.webhook.shipping.trigger_webhook_sync")
+def test_get_excluded_shipping_methods_or_fetch_concurrent_fetch_timed_out(
+    mocked_webhook, mocked_cache_get, mocked_wait_timeout, shipping_app_factory
+):
+    # given
+    shipping_app_factory()
+    event_type = WebhookEventSyncType.CHECKOUT_FILTER_SHIPPING_METHODS
+    webhooks = get_webhooks_for_event(event_type)
+    webhook_reason = "Order contains dangerous products."
+
+    payload = json.dumps({"checkout": {"id": 1}})
+    payload_hash = get_payload_hash(payload)
+    cache_key = CACHE_EXCLUDED_SHIPPING_KEY + "token"
+
+    # other thread cached the data after the wait for it timed out
+    mocked_cache_get.side_effect = [None, (payload_hash, {"1": [webhook_reason]})]
+    flight = _InFlightFetch()
+    flight_key = (get_hashed_cache_key(cache_key), payload_hash)
+
+    # when
+    with mock.patch.dict(
+        "saleor.plugins.webhook.shipping._in_flight", {flight_key: flight}
+    ):
+        reasons_map = get_excluded_shipping_methods_or_fetch(
+            webhooks, event_type, payload, cache_key
+        )
+
+    # then
+    assert reasons_map == {"1": [webhook_reason]}
+    assert not mocked_webhook.called
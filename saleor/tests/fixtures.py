@@ -85,6 +85,7 @@ from ..payment.models import Payment
 from ..plugins.manager import get_plugins_manager
 from ..plugins.models import PluginConfiguration
 from ..plugins.vatlayer.plugin import VatlayerPlugin
+from ..plugins.webhook.shipping import clear_local_cache, clear_webhooks_cache
 from ..plugins.webhook.tasks import WebhookResponse
 from ..plugins.webhook.utils import to_payment_app_id
 from ..product import ProductMediaTypes, ProductTypeKind
@@ -240,6 +241,15 @@ def setup_dummy_gateways(settings):
     return settings
 
 
+@pytest.fixture(autouse=True)
+def clear_excluded_shipping_local_cache():
+    clear_local_cache()
+    clear_webhooks_cache()
+    yield
+    clear_local_cache()
+    clear_webhooks_cache()
+
+
 @pytest.fixture
 def sample_gateway(settings):
     settings.PLUGINS += [